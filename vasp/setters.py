@@ -14,6 +14,12 @@ from .vasp import log, Vasp
 from .monkeypatch import monkeypatch_class
 from ase.calculators.calculator import FileIOCalculator
 
+# kwargs that set() expands with the matching set_<key>_dict method.
+_SPECIAL_SETTERS = ('xc', 'ispin', 'ldau_luj')
+
+# Changes that unset the DFT+U tags.
+_LDAU_NONE = {'ldaul': None, 'ldauu': None, 'ldauj': None}
+
 
 @monkeypatch_class(Vasp)
 def set(self, **kwargs):
@@ -27,14 +33,10 @@ def set(self, **kwargs):
 
     """
     log.debug('Setting {}'.format(kwargs))
-    if 'xc' in kwargs:
-        kwargs.update(self.set_xc_dict(kwargs['xc']))
-
-    if 'ispin' in kwargs:
-        kwargs.update(self.set_ispin_dict(kwargs['ispin']))
-
-    if 'ldau_luj' in kwargs:
-        kwargs.update(self.set_ldau_luj_dict(kwargs['ldau_luj']))
+    for key in _SPECIAL_SETTERS:
+        if key in kwargs:
+            setter = getattr(self, 'set_{}_dict'.format(key))
+            kwargs.update(setter(kwargs[key]))
 
     original_params = self.parameters
 
@@ -64,25 +66,24 @@ def set_ispin_dict(self, val):
     # 2. if you set magmom on each atom in an Atoms object and do not use
     # magmom then we use the atoms magmom, if we have ispin=2 set.
     # we set lorbit to 11 if ispin=2 so we can get the individual moments.
+    params = self.parameters
     if val is None:
-        d = {}
-        for key in ['ispin', 'magmom', 'lorbit']:
-            if key in self.parameters:
-                d[key] = None
-        return d
+        return {key: None for key in ('ispin', 'magmom', 'lorbit')
+                if key in params}
     elif val == 1:
         d = {'ispin': 1}
-        if 'magmom' in self.parameters:
+        if 'magmom' in params:
             d['magmom'] = None
 
         return d
     elif val == 2:
         d = {'ispin': 2}
-        if 'magmom' not in self.parameters:
-            d['magmom'] = [atom.magmom for atom
-                           in self.atoms[self.resort]]
+        if 'magmom' not in params:
+            # index the moments array directly rather than slicing atoms.
+            mm = self.atoms.get_initial_magnetic_moments()
+            d['magmom'] = mm[self.resort].tolist()
         # print out individual magnetic moments.
-        if 'lorbit' not in self.parameters:
+        if 'lorbit' not in params:
             d['lorbit'] = 11
 
         return d
@@ -117,22 +118,23 @@ def set_ldau_luj_dict(self, val):
         self.sort_atoms(atoms)
 
     if val is not None:
+        atoms = self.atoms
+        ppp_list = self.ppp_list
         atom_types = [x[0] if isinstance(x[0], str)
-                      else self.atoms[x[0]].symbol
-                      for x in self.ppp_list]
+                      else atoms[x[0]].symbol
+                      for x in ppp_list]
+
+        entries = [val[sym] for sym in atom_types]
 
         d = {}
 
-        d['ldaul'] = [val[sym]['L'] for sym in atom_types]
-        d['ldauu'] = [val[sym]['U'] for sym in atom_types]
-        d['ldauj'] = [val[sym]['J'] for sym in atom_types]
+        d['ldaul'] = [e['L'] for e in entries]
+        d['ldauu'] = [e['U'] for e in entries]
+        d['ldauj'] = [e['J'] for e in entries]
         return d
     else:
-        d = {}
-        d['ldaul'] = None
-        d['ldauu'] = None
-        d['ldauj'] = None
-        return d
+        # copy so callers cannot modify the module constant.
+        return _LDAU_NONE.copy()
 
 
 @monkeypatch_class(Vasp)
@@ -163,11 +165,14 @@ def set_xc_dict(self, val):
     Adds all the xc_defaults flags for the chosen xc.
 
     """
-    d = {'xc': val.lower()}
-    oxc = self.parameters.get('xc', None)
+    xc_defaults = Vasp.xc_defaults
+    params = self.parameters
+    xc = val.lower()
+    d = {'xc': xc}
+    oxc = params.get('xc', None)
     if oxc:
-        for key in Vasp.xc_defaults[oxc.lower()]:
-            if key in self.parameters:
+        for key in xc_defaults[oxc.lower()]:
+            if key in params:
                 d[key] = None
-    d.update(Vasp.xc_defaults[val.lower()])
+    d.update(xc_defaults[xc])
     return d
@@ -6,11 +6,25 @@ These are separated out by design to keep vasp.py small. Each function is
 monkey-patched onto the Vasp class as if it were defined in vasp.py.
 
 """
+import hashlib
+import logging
 import os
+import shutil
 import numpy as np
 from .vasp import Vasp, log
 from vasp.monkeypatch import monkeypatch_class
 from ase.calculators.calculator import FileIOCalculator
+from ase.io.jsonio import encode
+
+# Buffer size for writing input files. Larger than the default so each
+# file goes out in few write calls, which helps on network filesystems.
+_BUFSIZE = 1024 * 1024
+
+# Parameters that are not INCAR tags. These are skipped in write_incar.
+_SPECIAL_KWARGS = frozenset(Vasp.special_kwargs)
+
+# Directory values recognized as booleans by write_db.
+_LITERALS = {'False': False, 'True': True}
 
 
 @monkeypatch_class(Vasp)
@@ -19,13 +33,58 @@ def write_input(self, atoms=None, properties=None, system_changes=None):
     # this creates the directory if needed
     FileIOCalculator.write_input(self, atoms, properties, system_changes)
 
-    if 'spring' not in self.parameters:  # do not write if NEB
-        self.write_poscar()
-    self.write_incar()
-    if 'kspacing' not in self.parameters:
-        self.write_kpoints()
-    self.write_potcar()
-    self.write_db()
+    # Resolve the directory once and give each writer its path.
+    d = self.calc_dir
+    params = self.parameters
+
+    if 'spring' not in params:  # do not write if NEB
+        self.write_poscar(os.path.join(d, 'POSCAR'))
+    self.write_incar(os.path.join(d, 'INCAR'))
+    if 'kspacing' not in params:
+        self.write_kpoints(os.path.join(d, 'KPOINTS'))
+    self.write_potcar(os.path.join(d, 'POTCAR'))
+
+    # Rewriting DB.db is a full database open/write cycle, so skip it
+    # when nothing stored in it has changed since the last write.
+    db = os.path.join(d, 'DB.db')
+    fp = _db_fingerprint(self)
+    stale = fp is None or fp != getattr(self, '_last_db_fp', None)
+    if stale or not os.path.exists(db):
+        self.write_db(db)
+        self._last_db_fp = fp
+    else:
+        log.debug('DB unchanged, not rewriting it.')
+
+
+def _db_fingerprint(calc):
+    """Return a hash of what write_input stores in DB.db.
+
+    Returns None if it cannot be computed, in which case the DB is
+    always written.
+
+    """
+    from ase.db.row import atoms2dict
+
+    if calc.atoms is None or getattr(calc, 'resort', None) is None:
+        return None
+    # This is the atoms object write_db stores. The copy has no
+    # calculator, so atoms2dict does not call check_state on it. The
+    # calculator part of the row comes from the parameters and
+    # results, which are hashed separately below.
+    atoms = calc.get_atoms().copy()
+    row = atoms2dict(atoms)
+    # unique_id is random for every row.
+    row.pop('unique_id', None)
+    try:
+        s = encode({'path': calc.calc_dir,
+                    'parameters': calc.parameters,
+                    'results': calc.results,
+                    'resort': list(calc.resort),
+                    'ppp_list': calc.ppp_list,
+                    'atoms': row})
+    except (TypeError, ValueError):
+        return None
+    return hashlib.sha1(s.encode('utf-8')).hexdigest()
 
 
 @monkeypatch_class(Vasp)
@@ -85,24 +144,26 @@ def write_db(self,
     # Get keys-value-pairs from directory name.
     # Collect only path names with 'parser' in them.
     if parser is not None:
-        path = [x for x in self.calc_dir.split('/') if parser in x]
+        path = (x for x in self.calc_dir.split('/') if parser in x)
 
         for key_value in path:
-            key = key_value.split(parser)[0]
-            value = key_value.split(parser)[1]
+            # Only the text up to the next parser is the value.
+            key, _, value = key_value.partition(parser)
+            value = value.partition(parser)[0]
 
             # Try to recognize characters and convert to
             # specific data types for easy access later.
-            if '.' in value:
-                value = float(value)
+            if value in _LITERALS:
+                value = _LITERALS[value]
             elif value.isdigit():
                 value = int(value)
-            elif value == 'False':
-                value = bool(False)
-            elif value == 'True':
-                value = bool(True)
             else:
-                value = str(value)
+                # ase.db rejects strings that float() can parse, so
+                # anything float-like has to be stored as a float.
+                try:
+                    value = float(value)
+                except ValueError:
+                    pass  # leave it as a string
 
             # Add directory keys
             keys[key] = value
@@ -114,6 +175,10 @@ def write_db(self,
                  'ppp_list': self.ppp_list})
     log.debug('data = {}'.format(data))
 
+    # The file the db is generated in. When overwriting, this is a
+    # temporary file that replaces fname once it is complete.
+    dbname = fname
+
     # Only relevant for writing single entry DB file.
     if overwrite:
         log.debug('overwriting db')
@@ -126,7 +191,12 @@ def write_db(self,
                     keys.update(dbatoms.key_value_pairs)
                 except (AttributeError, KeyError):
                     pass
-            os.unlink(fname)
+
+        # Keep the extension so ase.db can tell the backend type.
+        root, ext = os.path.splitext(fname)
+        dbname = root + '.tmp' + ext
+        if os.path.exists(dbname):
+            os.unlink(dbname)
 
         # Remove keys and data in del_info.
         for k in del_info:
@@ -138,9 +208,18 @@ def write_db(self,
     log.debug('writing db')
 
     # Generate the db file
-    with connect(fname, use_lock_file=False) as db:
-        log.debug('db handle: {}'.format(db))
-        db.write(atoms, key_value_pairs=keys, data=data)
+    try:
+        with connect(dbname, use_lock_file=False) as db:
+            log.debug('db handle: {}'.format(db))
+            db.write(atoms, key_value_pairs=keys, data=data)
+    except BaseException:
+        # Do not leave a partial temporary file next to the old DB.
+        if dbname != fname and os.path.exists(dbname):
+            os.unlink(dbname)
+        raise
+
+    if dbname != fname:
+        os.replace(dbname, fname)
 
     log.debug('Done with db')
 
@@ -154,9 +233,10 @@ def write_poscar(self, fname=None):
         fname = os.path.join(self.calc_dir, 'POSCAR')
 
     from ase.io.vasp import write_vasp
-    write_vasp(fname,
-               self.atoms,
-               symbol_count=self.symbol_count)
+    with open(fname, 'w', buffering=_BUFSIZE) as f:
+        write_vasp(f,
+                   self.atoms,
+                   symbol_count=self.symbol_count)
 
 
 @monkeypatch_class(Vasp)
@@ -172,32 +252,46 @@ def write_incar(self, incar=None):
     if incar is None:
         incar = os.path.join(self.calc_dir, 'INCAR')
 
-    incar_keys = list(set(self.parameters) - set(self.special_kwargs))
-    d = {key: self.parameters[key] for key in incar_keys}
+    params = self.parameters
+    ppp_list = self.ppp_list
+    debug = log.isEnabledFor(logging.DEBUG)
 
-    with open(incar, 'w') as f:
-        f.write('INCAR created by Atomic Simulation Environment\n')
-        for key, val in d.items():
+    # Collect the lines and hand them to the file in one call.
+    lines = ['INCAR created by Atomic Simulation Environment\n']
+    for key, val in params.items():
+        if key in _SPECIAL_KWARGS:
+            continue
+        if debug:
             log.debug(f'"{key}", {val}, {type(val)}')
-            key = ' ' + key.upper()
-            if val is None:
-                # Do not write out None values
-                # It is how we delete tags
-                continue
-            # I am very unhappy about this special case. [2020-08-10 Mon] why is
-            # there an extra space in front? You get the wrong result without
-            # it.
-            elif key == ' RWIGS':
-                val = ' '.join(str(val[x[0]]) for x in self.ppp_list)
-            elif isinstance(val, bool):
-                val = '.TRUE.' if val else '.FALSE.'
-            # Added [2020-08-10 Mon] for issue #57.
-            elif isinstance(val, str):
-                pass
-            # elif isinstance(val, list) or isinstance(val, tuple):
-            elif hasattr(val, '__iter__'):
-                val = ' '.join(str(x) for x in val)
-            f.write(f'{key} = {val}\n')
+        key = ' ' + key.upper()
+        if val is None:
+            # Do not write out None values
+            # It is how we delete tags
+            continue
+        # I am very unhappy about this special case. [2020-08-10 Mon] why is
+        # there an extra space in front? You get the wrong result without
+        # it.
+        elif key == ' RWIGS':
+            # rwigs is stored as a {sym: radius} dict (see validate.rwigs),
+            # so it has to be put in POTCAR order here.
+            val = ' '.join(str(val[x[0]]) for x in ppp_list)
+        elif isinstance(val, bool):
+            val = '.TRUE.' if val else '.FALSE.'
+        # Added [2020-08-10 Mon] for issue #57.
+        elif isinstance(val, str):
+            pass
+        # scalars are written as is. bool is handled above.
+        elif isinstance(val, (int, float)):
+            pass
+        elif isinstance(val, (list, tuple, np.ndarray)):
+            val = ' '.join(map(str, val))
+        # any other iterable
+        elif hasattr(val, '__iter__'):
+            val = ' '.join(str(x) for x in val)
+        lines.append(f'{key} = {val}\n')
+
+    with open(incar, 'w', buffering=_BUFSIZE) as f:
+        f.writelines(lines)
 
 
 @monkeypatch_class(Vasp)
@@ -234,7 +328,8 @@ def write_kpoints(self, fname=None):
 
     if kpts is None:
         NKPTS = None
-    elif len(np.array(kpts).shape) == 1:
+    # a flat list of numbers (e.g. [4, 4, 4]) means automatic.
+    elif len(kpts) == 0 or not hasattr(kpts[0], '__len__'):
         NKPTS = 0  # automatic
     else:
         NKPTS = len(p['kpts'])
@@ -253,51 +348,54 @@ def write_kpoints(self, fname=None):
     else:
         MODE = 'c'
 
-    with open(fname, 'w') as f:
-        # line 1 - comment
-        f.write('KPOINTS created by Atomic Simulation Environment\n')
-        # line 2 - number of kpts
-        if MODE in ['c', 'k', 'm', 'g', 'r']:
-            f.write('{}\n'.format(NKPTS))
-        elif MODE in ['l']:  # line mode, default intersections is 10
-            f.write('{}\n'.format(p.get('kpts_nintersections')))
-
-        # line 3
-        if MODE in ['m', 'g']:
-            if MODE == 'm':
-                f.write('Monkhorst-Pack\n')
-            elif MODE == 'g':
-                f.write('Gamma\n')
-        elif MODE in ['c', 'k']:
-            f.write('Cartesian\n')
-        elif MODE == 'l':
-            f.write('Line-mode\n')
+    parts = []
+    # line 1 - comment
+    parts.append('KPOINTS created by Atomic Simulation Environment\n')
+    # line 2 - number of kpts
+    if MODE in ['c', 'k', 'm', 'g', 'r']:
+        parts.append('{}\n'.format(NKPTS))
+    elif MODE in ['l']:  # line mode, default intersections is 10
+        parts.append('{}\n'.format(p.get('kpts_nintersections')))
+
+    # line 3
+    if MODE in ['m', 'g']:
+        if MODE == 'm':
+            parts.append('Monkhorst-Pack\n')
+        elif MODE == 'g':
+            parts.append('Gamma\n')
+    elif MODE in ['c', 'k']:
+        parts.append('Cartesian\n')
+    elif MODE == 'l':
+        parts.append('Line-mode\n')
+    else:
+        parts.append('Reciprocal\n')
+
+    # kpoints lines
+    points = list()
+    if MODE in ['m', 'g']:
+        points.append(p.get('kpts', (1, 1, 1)))
+        if p.get('gamma'):
+            points.append(p['gamma'])
         else:
-            f.write('Reciprocal\n')
-
-        # kpoints lines
-        points = list()
-        if MODE in ['m', 'g']:
-            points.append(p.get('kpts', (1, 1, 1)))
-            if p.get('gamma'):
-                points.append(p['gamma'])
-            else:
-                points.append(['0.0'] * 3)
-        elif MODE in ['c', 'k', 'r']:
-            points.append(p['kpts'])
-            if any(len(point) != 4 for point in points):
-                raise ValueError('Kpoint ERROR: weights must be provided')
-        elif MODE == 'l':
-            if p.get('reciprocal'):
-                f.write('Reciprocal\n')
-            else:
-                f.write('Cartesian\n')
-            points.append(p['kpts'])
+            points.append(['0.0'] * 3)
+    elif MODE in ['c', 'k', 'r']:
+        points.append(p['kpts'])
+        if any(len(point) != 4 for point in points):
+            raise ValueError('Kpoint ERROR: weights must be provided')
+    elif MODE == 'l':
+        if p.get('reciprocal'):
+            parts.append('Reciprocal\n')
+        else:
+            parts.append('Cartesian\n')
+        points.append(p['kpts'])
+
 
+    for point in points:
+        text = ' '.join(map(str, point)) + '\n'
+        parts.append(text)
 
-        for point in points:
-            text = ' '.join(map(str, point)) + '\n'
-            f.write(text)
+    with open(fname, 'w', buffering=_BUFSIZE) as f:
+        f.writelines(parts)
 
 
 @monkeypatch_class(Vasp)
@@ -310,11 +408,15 @@ def write_potcar(self, fname=None):
     if fname is None:
         fname = os.path.join(self.calc_dir, 'POTCAR')
 
-    with open(fname, 'wb') as potfile:
+    vpp = os.environ['VASP_PP_PATH']
+    with open(fname, 'wb', buffering=_BUFSIZE) as potfile:
         for _, pfile, _ in self.ppp_list:
-            pfile = os.path.join(os.environ['VASP_PP_PATH'], pfile)
-            if not os.path.exists(pfile):
-                raise Exception('{} does not exist', pfile)
-            with open(pfile, 'rb') as f:
-                potfile.write(f.read())
-                log.debug('Added pfile')
+            pfile = os.path.join(vpp, pfile)
+            # stream the file in 1 MiB chunks instead of reading it
+            # all into memory.
+            try:
+                with open(pfile, 'rb') as f:
+                    shutil.copyfileobj(f, potfile, length=_BUFSIZE)
+                    log.debug('Added pfile')
+            except FileNotFoundError:
+                raise Exception('{} does not exist'.format(pfile)) from None